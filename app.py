@@ -2,11 +2,21 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import numpy as np
+from scipy import sparse
 import re
 from datetime import datetime
-from collections import Counter
 import zipfile
 import io
+import os
+import shutil
+import tempfile
+import weakref
+
+try:
+    import duckdb
+except ImportError:  # Backend optionnel pour les archives volumineuses
+    duckdb = None
 
 def is_phone_number(name):
     """Vérifie si le nom est un numéro de téléphone (contact non enregistré)"""
@@ -23,15 +33,16 @@ def extract_group_name(filename):
     name = re.sub(r'\s*\(\d+\)\s*$', '', name)
     return name.strip()
 
-def parse_whatsapp_file(file_content, group_name):
-    """Parse le contenu d'un fichier WhatsApp et extrait les messages"""
-    lines = file_content.split('\n')
+def parse_whatsapp_lines(lines, group_name, current_message=None):
+    """Parse une suite de lignes d'un fichier WhatsApp.
+
+    Retourne les messages complets et le message en cours, qui peut se poursuivre
+    sur les lignes suivantes : il est à repasser à l'appel suivant.
+    """
     messages = []
     
     pattern = r'(\d{1,2}/\d{1,2}/\d{4}),\s*(\d{1,2}:\d{2})\s*-\s*([^:]+):\s*(.*)'
     
-    current_message = None
-    
     for line in lines:
         match = re.match(pattern, line)
         if match:
@@ -61,6 +72,12 @@ def parse_whatsapp_file(file_content, group_name):
         elif current_message and line.strip():
             current_message['message'] += ' ' + line.strip()
     
+    return messages, current_message
+
+def parse_whatsapp_file(file_content, group_name):
+    """Parse le contenu d'un fichier WhatsApp et extrait les messages"""
+    messages, current_message = parse_whatsapp_lines(file_content.split('\n'), group_name)
+    
     if current_message:
         messages.append(current_message)
     
@@ -82,6 +99,1010 @@ def load_file(uploaded_file):
     
     return None, group_name
 
+def read_line_chunks(binary_file, chunk_lines):
+    """Décode un flux binaire en utf-8 et produit des paquets de `chunk_lines` lignes"""
+    text = io.TextIOWrapper(binary_file, encoding='utf-8', errors='ignore', newline='\n')
+    try:
+        chunk = []
+        for line in text:
+            chunk.append(line.rstrip('\n'))
+            if len(chunk) >= chunk_lines:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        # Ne pas fermer le flux sous-jacent avec l'enveloppe texte
+        text.detach()
+
+def iter_file_chunks(uploaded_file, chunk_lines):
+    """Lit un fichier txt ou zip en flux, par paquets de lignes, sans le charger en entier"""
+    uploaded_file.seek(0)
+    if uploaded_file.name.endswith('.zip'):
+        with zipfile.ZipFile(uploaded_file) as z:
+            txt_files = [f for f in z.namelist() if f.endswith('.txt')]
+            if txt_files:
+                with z.open(txt_files[0]) as f:
+                    yield from read_line_chunks(f, chunk_lines)
+    else:
+        yield from read_line_chunks(uploaded_file, chunk_lines)
+
+# Mots vides français (et artefacts des exports WhatsApp) ignorés dans l'analyse du vocabulaire
+FRENCH_STOPWORDS = frozenset("""
+    au aux avec ce ces cet cette dans de des du elle elles en et eux il ils je la le les leur leurs
+    lui ma mais me mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta
+    te tes toi ton tu un une vos votre vous est sont suis es sommes êtes était étaient été être ai
+    as avons avez ont avait avaient eu avoir fait faire ça ca cela ceci ici là oui non très plus
+    moins tout tous toute toutes bien comme aussi donc alors car si sans sous entre vers chez déjà
+    encore même quand où dont lors après avant peu peut ya
+    médias omis message supprimé null
+""".split())
+
+TOKEN_TYPES = {
+    'word': 'Mots',
+    'emoji': 'Emojis',
+    'link': 'Liens',
+    'mention': 'Mentions',
+}
+
+URL_PATTERN = r'(?i:https?://|www\.)\S+'
+MENTION_PATTERN = '\\B@(?:\u2068[^\u2069\n]+\u2069|[^\\W_][\\w.]*)'
+# Drapeaux (paires d'indicateurs régionaux) d'abord, puis les emojis simples (hors modificateurs de teint)
+EMOJI_PATTERN = (
+    '(?:[\U0001F1E6-\U0001F1FF]{2}|'
+    '[\U0001F000-\U0001F3FA\U0001F400-\U0001FAFF\u2300-\u23FF\u2600-\u27BF\u2B00-\u2BFF'
+    '\u3030\u303D\u3297\u3299])'
+)
+WORD_PATTERN = r"[^\W\d_]{2,}"
+TOKEN_PATTERN = '|'.join([URL_PATTERN, MENTION_PATTERN, EMOJI_PATTERN, WORD_PATTERN])
+
+def build_filter_mask(frame, selected_groups, selected_senders, start_date, end_date):
+    """Construit le masque des filtres (groupes, participants, période) pour un DataFrame"""
+    return (
+        (frame['groupe'].isin(selected_groups)) &
+        (frame['sender'].isin(selected_senders)) &
+        (frame['date'] >= start_date) &
+        (frame['date'] <= end_date)
+    )
+
+def tokenize_messages(df):
+    """Tokenise tous les messages en une seule passe et agrège les comptes.
+
+    Retourne un triplet (keys, counts, vocab) : `keys` liste les combinaisons
+    (groupe, sender, date), `counts` est une matrice creuse keys × tokens et
+    `vocab` décrit chaque colonne (token, type). Une vue filtrée n'est alors
+    qu'une somme des lignes sélectionnées.
+    """
+    key_columns = ['groupe', 'sender', 'date']
+    row_ids = df.groupby(key_columns, sort=False).ngroup().to_numpy()
+    _, first_rows = np.unique(row_ids, return_index=True)
+    keys = df[key_columns].iloc[first_rows].reset_index(drop=True)
+
+    # Une seule passe regex sur le texte concaténé : les '\n' délimitent les messages
+    text = '\n'.join(df['message'].tolist())
+    tokens = np.array(re.findall(TOKEN_PATTERN + '|\n', text), dtype=object)
+    message_ids = np.cumsum(tokens == '\n')
+
+    # Typage et normalisation sur les tokens distincts uniquement
+    codes, uniques = pd.factorize(tokens)
+    uniques = pd.Series(uniques, dtype=object)
+    # Un token ne doit jamais chevaucher deux messages, sinon les lignes sont décalées
+    assert not uniques[uniques != '\n'].str.contains('\n', regex=False).any()
+    types = pd.Series('word', index=uniques.index, dtype=object)
+    types[uniques.str.match(EMOJI_PATTERN)] = 'emoji'
+    types[uniques.str.startswith('@')] = 'mention'
+    types[uniques.str.match(URL_PATTERN)] = 'link'
+
+    # Les liens gardent leur casse (URL sensibles à la casse) ; les mentions sont
+    # rapprochées comme dans les interactions ("@⁨Bob⁩" et "@bob" comptent ensemble)
+    normalized = uniques.where(types == 'link', uniques.str.lower())
+    mentions = (types == 'mention').to_numpy()
+    normalized[mentions] = '@' + normalize_contact(uniques[mentions].str[1:].str.strip('\u2068\u2069'))
+    norm_codes, norm_uniques = pd.factorize(normalized)
+    codes = norm_codes[codes]
+    norm_types = types.groupby(norm_codes).first().to_numpy()
+
+    keep = ~pd.Index(norm_uniques).isin(FRENCH_STOPWORDS | {'\n'})[codes]
+    token_codes, kept = pd.factorize(codes[keep])
+
+    vocab = pd.DataFrame({'token': norm_uniques[kept], 'type': norm_types[kept]})
+
+    rows = row_ids[message_ids[keep]]
+    counts = sparse.csr_matrix(
+        (np.ones(len(token_codes), dtype=np.int32), (rows, token_codes)),
+        shape=(len(keys), len(vocab))
+    )
+    counts.sum_duplicates()
+    return keys, counts, vocab
+
+def build_token_index(file_keys, df):
+    """Version de tokenize_messages conservée dans la session pour le mode en mémoire"""
+    cached = st.session_state.get('token_index')
+    if cached is not None and cached[0] == file_keys:
+        return cached[1]
+    token_index = tokenize_messages(df)
+    st.session_state['token_index'] = (file_keys, token_index)
+    return token_index
+
+INTERACTION_KINDS = {
+    'reply': 'Réponses',
+    'mention': 'Mentions',
+}
+
+# Mentions WhatsApp : "@⁨Nom complet⁩" (entre isolants Unicode) ou "@237699000000"
+MENTION_TARGET_PATTERN = '@(?:\u2068([^\u2069\n]+)\u2069|([^\\W_][\\w.]*))'
+
+def normalize_contact(names):
+    """Normalise des noms de contacts pour rapprocher mentions et participants"""
+    names = names.str.strip().str.lower()
+    digits = names.str.replace(r'\D', '', regex=True)
+    return digits.where(names.str.fullmatch(r'\+?[\d\s\-\.]+'), names)
+
+def extract_mentions(messages):
+    """Retourne les contacts mentionnés (normalisés), indexés par message"""
+    has_mention = messages.str.contains('@', regex=False).to_numpy()
+    found = messages[has_mention].str.extractall(MENTION_TARGET_PATTERN)
+    contacts = normalize_contact(found[0].fillna(found[1]))
+    contacts.index = found.index.get_level_values(0)
+    return contacts
+
+def build_interaction_edges(df, window_minutes):
+    """Construit les interactions entre participants de chaque groupe.
+
+    Une réponse relie un message à celui du participant précédent dans le même
+    groupe s'il a été envoyé moins de `window_minutes` après ; une mention relie
+    l'auteur au participant cité. Retourne (senders, edges) où `edges` agrège
+    les poids par (groupe, date, kind, source, target), source et target étant
+    des positions dans `senders`.
+    """
+    ordered = df.sort_values(['groupe', 'datetime'], kind='stable')
+    senders = pd.Index(sorted(df['sender'].unique()))
+    codes = senders.get_indexer(ordered['sender'])
+
+    # Transitions entre locuteurs consécutifs (décalage d'une ligne)
+    previous = np.roll(codes, 1)
+    is_reply = (
+        (ordered['groupe'] == ordered['groupe'].shift()).to_numpy() &
+        (ordered['datetime'].diff() <= pd.Timedelta(minutes=window_minutes)).to_numpy() &
+        (codes != previous)
+    )
+    replies = pd.DataFrame({
+        'groupe': ordered['groupe'].to_numpy()[is_reply],
+        'date': ordered['date'].to_numpy()[is_reply],
+        'kind': 'reply',
+        'source': codes[is_reply],
+        'target': previous[is_reply]
+    })
+
+    # Mentions explicites
+    contacts = extract_mentions(ordered['message'])
+    contact_codes = pd.Series(np.arange(len(senders)), index=normalize_contact(senders.to_series()))
+    contact_codes = contact_codes[~contact_codes.index.duplicated()]
+    targets = contacts.map(contact_codes)
+    positions = ordered.index.get_indexer(contacts.index)
+    resolved = targets.notna().to_numpy()
+    positions = positions[resolved]
+    mentions = pd.DataFrame({
+        'groupe': ordered['groupe'].to_numpy()[positions],
+        'date': ordered['date'].to_numpy()[positions],
+        'kind': 'mention',
+        'source': senders.get_indexer(ordered['sender'].to_numpy()[positions]),
+        'target': targets.to_numpy()[resolved].astype(int)
+    })
+
+    edges = pd.concat([replies, mentions], ignore_index=True)
+    edges = edges[edges['source'] != edges['target']]
+    edges = edges.groupby(['groupe', 'date', 'kind', 'source', 'target']).size().reset_index(name='weight')
+    return senders, edges
+
+def get_interaction_edges(file_keys, df, window_minutes):
+    """Version de build_interaction_edges conservée dans la session (dernière fenêtre seulement)"""
+    cached = st.session_state.get('interaction_edges')
+    if cached is not None and cached[0] == (file_keys, window_minutes):
+        return cached[1]
+    interactions = build_interaction_edges(df, window_minutes)
+    st.session_state['interaction_edges'] = ((file_keys, window_minutes), interactions)
+    return interactions
+
+def interaction_matrix(interactions, selected_groups, selected_senders, start_date, end_date, kinds):
+    """Retourne la matrice creuse d'adjacence sender × sender pour les filtres donnés"""
+    senders, edges = interactions
+    selected = senders.get_indexer(selected_senders)
+    mask = (
+        (edges['groupe'].isin(selected_groups)) &
+        (edges['date'] >= start_date) &
+        (edges['date'] <= end_date) &
+        (edges['kind'].isin(kinds)) &
+        (edges['source'].isin(selected)) &
+        (edges['target'].isin(selected))
+    )
+    subset = edges[mask]
+    return sparse.csr_matrix(
+        (subset['weight'].to_numpy(), (subset['source'].to_numpy(), subset['target'].to_numpy())),
+        shape=(len(senders), len(senders))
+    )
+
+def top_tokens(token_index, row_mask, token_type, by=None, value=None, n=20):
+    """Retourne les n tokens les plus fréquents d'un type donné pour les lignes filtrées.
+
+    Si `by` est renseigné ('sender' ou 'groupe'), le décompte est restreint à `value`.
+    """
+    keys, counts, vocab = token_index
+    row_mask = np.asarray(row_mask, dtype=bool)
+    if by is not None:
+        row_mask = row_mask & (keys[by] == value).to_numpy()
+
+    totals = np.asarray(counts[row_mask].sum(axis=0)).ravel()
+    selected = (vocab['type'].to_numpy() == token_type) & (totals > 0)
+
+    top = pd.DataFrame({'Token': vocab['token'].to_numpy()[selected], 'Occurrences': totals[selected]})
+    return top.sort_values(['Occurrences', 'Token'], ascending=[False, True]).head(n).reset_index(drop=True)
+
+def forget_messages():
+    """Libère les messages de la session et les données qui en sont dérivées"""
+    for key in ('loaded_messages', 'token_index', 'interaction_edges'):
+        st.session_state.pop(key, None)
+
+def load_messages(file_keys, uploaded_files):
+    """Parse et combine les fichiers en un seul DataFrame (mode en mémoire).
+
+    Le résultat est conservé dans la session pour le jeu de fichiers courant
+    (remplacé au prochain chargement) et ne doit pas être modifié.
+    """
+    loaded = st.session_state.get('loaded_messages')
+    if loaded is not None and loaded[0] == file_keys:
+        return loaded[1]
+    forget_messages()
+    
+    all_dfs = []
+    group_names = []
+    
+    for uploaded_file in uploaded_files:
+        uploaded_file.seek(0)
+        file_content, group_name = load_file(uploaded_file)
+        if file_content:
+            df_single = parse_whatsapp_file(file_content, group_name)
+            if not df_single.empty:
+                all_dfs.append(df_single)
+                if group_name not in group_names:
+                    group_names.append(group_name)
+    
+    df = pd.concat(all_dfs, ignore_index=True) if all_dfs else None
+    st.session_state['loaded_messages'] = (file_keys, (df, group_names))
+    return df, group_names
+
+@st.cache_data(show_spinner=False)
+def aggregate_messages(df, selected_groups, selected_senders, start_date, end_date):
+    """Agrège les messages filtrés par (groupe, participant) et par (date, groupe).
+
+    Toutes les vues du tableau de bord (classement, tableau détaillé,
+    chronologie, répartition par groupe, exports) dérivent de ces deux tables.
+    """
+    filtered_df = df[build_filter_mask(df, selected_groups, selected_senders, start_date, end_date)]
+    by_sender_group = (
+        filtered_df.assign(length=filtered_df['message'].str.len())
+        .groupby(['groupe', 'sender'])
+        .agg(Messages=('length', 'size'), Caractères=('length', 'sum'))
+        .reset_index()
+    )
+    by_date_group = filtered_df.groupby(['date', 'groupe']).size().reset_index(name='Messages')
+    return by_sender_group, by_date_group
+
+# === Backend DuckDB (archives plus volumineuses que la mémoire) ===
+
+def insert_duckdb_batch(con, df_batch, seq):
+    """Insère un paquet de messages parsés, ses tokens et ses mentions dans la base DuckDB"""
+    df_batch['seq'] = np.arange(seq, seq + len(df_batch))
+    con.register('batch', df_batch)
+    con.execute("""
+        INSERT INTO messages
+        SELECT seq, groupe, sender, datetime, CAST(datetime AS DATE), message FROM batch
+    """)
+
+    keys, counts, vocab = tokenize_messages(df_batch)
+    counts = counts.tocoo()
+    con.register('batch', pd.DataFrame({
+        'groupe': keys['groupe'].to_numpy()[counts.row],
+        'sender': keys['sender'].to_numpy()[counts.row],
+        'date': pd.to_datetime(keys['date'].to_numpy()[counts.row]),
+        'token': vocab['token'].to_numpy()[counts.col],
+        'type': vocab['type'].to_numpy()[counts.col],
+        'n': counts.data
+    }))
+    con.execute("INSERT INTO tokens SELECT groupe, sender, CAST(date AS DATE), token, type, n FROM batch")
+
+    contacts = extract_mentions(df_batch['message'])
+    con.register('batch', pd.DataFrame({
+        'groupe': df_batch['groupe'].to_numpy()[contacts.index],
+        'sender': df_batch['sender'].to_numpy()[contacts.index],
+        'date': df_batch['datetime'].to_numpy()[contacts.index],
+        'contact': contacts.to_numpy()
+    }))
+    con.execute("INSERT INTO mentions SELECT groupe, sender, CAST(date AS DATE), contact FROM batch")
+    con.unregister('batch')
+
+    return seq + len(df_batch)
+
+# Nombre de lignes lues, parsées et insérées à la fois en mode grandes archives
+DUCKDB_CHUNK_LINES = 200000
+
+def close_duckdb():
+    """Ferme la base DuckDB de la session, s'il y en a une, et supprime son répertoire"""
+    loaded = st.session_state.pop('loaded_duckdb', None)
+    if loaded is not None:
+        (con, _), cleanup = loaded[1], loaded[2]
+        con.close()
+        cleanup()
+
+def load_into_duckdb(file_keys, uploaded_files):
+    """Lit les fichiers en flux et les charge dans une base DuckDB sur disque.
+
+    Chaque fichier est traité par paquets de DUCKDB_CHUNK_LINES lignes : seul un
+    paquet de messages parsés est présent en mémoire à la fois. Le message en cours
+    à la fin d'un paquet est reporté sur le suivant. Les tokens et les mentions sont
+    pré-agrégés au chargement. Retourne la connexion et les noms de groupes.
+    La base est conservée dans la session pour le jeu de fichiers courant : quand
+    un autre jeu la remplace, la connexion est fermée et son répertoire supprimé
+    (de même à la fin de la session ou à l'arrêt du serveur).
+    """
+    loaded = st.session_state.get('loaded_duckdb')
+    if loaded is not None and loaded[0] == file_keys:
+        return loaded[1]
+    close_duckdb()
+
+    directory = tempfile.mkdtemp(prefix='whatsapp_analytics_')
+    con = duckdb.connect(os.path.join(directory, 'messages.duckdb'))
+    cleanup = weakref.finalize(con, shutil.rmtree, directory, ignore_errors=True)
+    con.execute("""
+        CREATE TABLE messages (seq BIGINT, groupe VARCHAR, sender VARCHAR, datetime TIMESTAMP, date DATE, message VARCHAR)
+    """)
+    con.execute("CREATE TABLE tokens (groupe VARCHAR, sender VARCHAR, date DATE, token VARCHAR, type VARCHAR, n INTEGER)")
+    con.execute("CREATE TABLE mentions (groupe VARCHAR, sender VARCHAR, date DATE, contact VARCHAR)")
+
+    group_names = []
+    seq = 0
+    for uploaded_file in uploaded_files:
+        group_name = extract_group_name(uploaded_file.name)
+        first_seq = seq
+        current_message = None
+        for lines in iter_file_chunks(uploaded_file, DUCKDB_CHUNK_LINES):
+            messages, current_message = parse_whatsapp_lines(lines, group_name, current_message)
+            if messages:
+                seq = insert_duckdb_batch(con, pd.DataFrame(messages), seq)
+        if current_message:
+            seq = insert_duckdb_batch(con, pd.DataFrame([current_message]), seq)
+
+        if seq > first_seq and group_name not in group_names:
+            group_names.append(group_name)
+
+    st.session_state['loaded_duckdb'] = (file_keys, (con, group_names), cleanup)
+    return con, group_names
+
+def sql_filter_clause(selected_groups, selected_senders, start_date, end_date):
+    """Construit la clause WHERE et ses paramètres correspondant aux filtres"""
+    clause = (
+        "groupe IN (SELECT unnest($groups::VARCHAR[])) AND "
+        "sender IN (SELECT unnest($senders::VARCHAR[])) AND "
+        "date BETWEEN $start_date AND $end_date"
+    )
+    params = {
+        'groups': list(selected_groups),
+        'senders': list(selected_senders),
+        'start_date': start_date,
+        'end_date': end_date
+    }
+    return clause, params
+
+@st.cache_data(show_spinner=False)
+def sql_overview(_con, file_keys):
+    """Retourne (messages, participants, première date, dernière date) de la base"""
+    return _con.cursor().execute(
+        "SELECT count(*), count(DISTINCT sender), min(date), max(date) FROM messages"
+    ).fetchone()
+
+@st.cache_data(show_spinner=False)
+def sql_senders(_con, file_keys, selected_groups):
+    """Liste triée des participants des groupes sélectionnés"""
+    rows = _con.cursor().execute(
+        "SELECT DISTINCT sender FROM messages WHERE groupe IN (SELECT unnest($groups::VARCHAR[]))",
+        {'groups': list(selected_groups)}
+    ).fetchall()
+    return sorted(row[0] for row in rows)
+
+@st.cache_data(show_spinner=False)
+def sql_aggregate_messages(_con, file_keys, selected_groups, selected_senders, start_date, end_date):
+    """Équivalent SQL de aggregate_messages, calculé dans DuckDB.
+
+    Le cache est indexé par `file_keys` (la base chargée), la connexion n'est pas hachée.
+    """
+    where, params = sql_filter_clause(selected_groups, selected_senders, start_date, end_date)
+    cur = _con.cursor()
+    by_sender_group = cur.execute(f"""
+        SELECT groupe, sender, count(*) AS "Messages", CAST(sum(length(message)) AS BIGINT) AS "Caractères"
+        FROM messages WHERE {where}
+        GROUP BY groupe, sender ORDER BY groupe, sender
+    """, params).df()
+    by_date_group = cur.execute(f"""
+        SELECT date, groupe, count(*) AS "Messages"
+        FROM messages WHERE {where}
+        GROUP BY date, groupe ORDER BY date, groupe
+    """, params).df()
+    by_date_group['date'] = by_date_group['date'].dt.date
+    return by_sender_group, by_date_group
+
+@st.cache_data(show_spinner=False)
+def sql_top_tokens(_con, file_keys, selected_groups, selected_senders, start_date, end_date, token_type, by=None, value=None, n=20):
+    """Équivalent SQL de top_tokens, à partir de la table des tokens pré-agrégés"""
+    where, params = sql_filter_clause(selected_groups, selected_senders, start_date, end_date)
+    params.update({'type': token_type, 'n': n})
+    if by is not None:
+        where += f" AND {by} = $value"
+        params['value'] = value
+    return _con.cursor().execute(f"""
+        SELECT token AS "Token", CAST(sum(n) AS BIGINT) AS "Occurrences"
+        FROM tokens WHERE {where} AND type = $type
+        GROUP BY token ORDER BY "Occurrences" DESC, token LIMIT $n
+    """, params).df()
+
+@st.cache_data(show_spinner=False)
+def sql_interaction_matrix(_con, file_keys, selected_groups, selected_senders, start_date, end_date, kinds, window_minutes):
+    """Équivalent SQL de build_interaction_edges + interaction_matrix.
+
+    Les transitions entre locuteurs sont calculées avec LAG() sur chaque groupe,
+    avant l'application des filtres de participants et de période.
+    Retourne (senders, matrice creuse d'adjacence).
+    """
+    where, params = sql_filter_clause(selected_groups, selected_senders, start_date, end_date)
+    selected_target = "target IN (SELECT unnest($senders::VARCHAR[]))"
+    cur = _con.cursor()
+    edges = []
+
+    if 'reply' in kinds:
+        edges.append(cur.execute(f"""
+            WITH ordered AS (
+                SELECT groupe, sender, date, datetime,
+                       lag(sender) OVER w AS target,
+                       lag(datetime) OVER w AS previous_datetime
+                FROM messages
+                WHERE groupe IN (SELECT unnest($groups::VARCHAR[]))
+                WINDOW w AS (PARTITION BY groupe ORDER BY datetime, seq)
+            )
+            SELECT sender AS source, target, count(*) AS weight
+            FROM ordered
+            WHERE {where} AND {selected_target}
+              AND sender <> target
+              AND datetime - previous_datetime <= to_minutes(CAST($window AS BIGINT))
+            GROUP BY source, target
+        """, {**params, 'window': window_minutes}).df())
+
+    if 'mention' in kinds:
+        senders = pd.Index(sorted(row[0] for row in cur.execute("SELECT DISTINCT sender FROM messages").fetchall()))
+        contacts = pd.DataFrame({'target': senders, 'contact': normalize_contact(senders.to_series()).to_numpy()})
+        contacts = contacts.drop_duplicates('contact')
+        cur.register('contacts', contacts)
+        edges.append(cur.execute(f"""
+            SELECT m.sender AS source, c.target, count(*) AS weight
+            FROM (SELECT * FROM mentions WHERE {where}) AS m
+            JOIN contacts AS c USING (contact)
+            WHERE {selected_target} AND m.sender <> c.target
+            GROUP BY source, c.target
+        """, params).df())
+        cur.unregister('contacts')
+
+    senders_index = pd.Index(sorted(selected_senders))
+    edges = pd.concat(edges, ignore_index=True) if edges else pd.DataFrame(columns=['source', 'target', 'weight'])
+    adjacency = sparse.csr_matrix(
+        (
+            edges['weight'].to_numpy(dtype=np.int64),
+            (senders_index.get_indexer(edges['source']), senders_index.get_indexer(edges['target']))
+        ),
+        shape=(len(senders_index), len(senders_index))
+    )
+    return senders_index, adjacency
+
+# === Sections du tableau de bord ===
+
+# Seule la section ouverte est affichée : Streamlit oublie l'état des widgets non
+# rendus, leurs valeurs sont donc recopiées dans des clés persistantes.
+def saved_value(key, default):
+    """Dernière valeur choisie pour un widget de section"""
+    return st.session_state.get(f'saved_{key}', default)
+
+def saved_index(key, options):
+    """Position de la dernière valeur choisie dans `options` (0 si absente)"""
+    value = saved_value(key, None)
+    return options.index(value) if value in options else 0
+
+def save_value(key):
+    """Callback on_change : recopie la valeur du widget dans sa clé persistante"""
+    st.session_state[f'saved_{key}'] = st.session_state[key]
+
+def build_stats_table(by_sender_group, selected_groups, multiple_groups):
+    """Construit le tableau détaillé par participant (affiché et exporté)"""
+    sender_totals = by_sender_group.groupby('sender')[['Messages', 'Caractères']].sum()
+    ranked = sender_totals.sort_values('Messages', ascending=False)
+    total_filtered = ranked['Messages'].sum()
+
+    if multiple_groups:
+        # Tableau avec ventilation par groupe
+        stats_df = pd.DataFrame({
+            'Participant': ranked.index,
+            'Total': ranked['Messages'].to_numpy(),
+            'Caractères': ranked['Caractères'].astype(int).to_numpy(),
+            'Moy. car.': (ranked['Caractères'] / ranked['Messages']).round(1).to_numpy(),
+            '%': (ranked['Messages'] / total_filtered * 100).round(1).to_numpy()
+        })
+
+        # Ajouter une colonne par groupe
+        group_breakdown = (
+            by_sender_group.pivot(index='sender', columns='groupe', values='Messages')
+            .reindex(index=ranked.index, columns=sorted(selected_groups))
+            .fillna(0)
+            .astype(int)
+        )
+        for grp in sorted(selected_groups):
+            stats_df[grp] = group_breakdown[grp].to_numpy()
+    else:
+        # Tableau simple
+        stats_df = pd.DataFrame({
+            'Participant': ranked.index,
+            'Messages': ranked['Messages'].to_numpy(),
+            'Caractères totaux': ranked['Caractères'].astype(int).to_numpy(),
+            'Longueur moyenne': (ranked['Caractères'] / ranked['Messages']).round(1).to_numpy(),
+            'Pourcentage': (ranked['Messages'] / total_filtered * 100).round(1).to_numpy()
+        })
+
+    stats_df.insert(0, 'Rang', range(1, len(stats_df) + 1))
+    return stats_df
+
+def render_ranking(by_sender_group, multiple_groups):
+    """Section : classement des interventions"""
+    # Compter les messages par participant (total)
+    message_counts = by_sender_group.groupby('sender')['Messages'].sum().reset_index()
+    message_counts.columns = ['Participant', 'Messages']
+    message_counts = message_counts.sort_values('Messages', ascending=True)
+
+    st.markdown("### 🏆 Classement des interventions")
+
+    if multiple_groups:
+        # Graphique empilé par groupe
+        group_participant_counts = by_sender_group[['sender', 'groupe', 'Messages']]
+
+        fig = px.bar(
+            group_participant_counts,
+            x='Messages',
+            y='sender',
+            color='groupe',
+            orientation='h',
+            title=f'Top {len(message_counts)} Participants (ventilé par groupe)',
+            color_discrete_sequence=px.colors.qualitative.Set2
+        )
+
+        # Trier par total de messages
+        order = message_counts['Participant'].tolist()
+        fig.update_yaxes(categoryorder='array', categoryarray=order)
+
+        fig.update_layout(
+            title=dict(font=dict(family='Poppins', size=20, color='#2d3748'), x=0.5),
+            xaxis=dict(title=dict(text='Nombre de messages', font=dict(family='Inter', size=14, color='#718096'))),
+            yaxis=dict(title=dict(text=''), tickfont=dict(family='Inter', size=11, color='#4a5568')),
+            legend=dict(title='Groupe', font=dict(family='Inter')),
+            plot_bgcolor='white',
+            paper_bgcolor='rgba(0,0,0,0)',
+            height=max(500, len(message_counts) * 35),
+            bargap=0.3
+        )
+    else:
+        # Graphique simple
+        fig = go.Figure()
+
+        fig.add_trace(go.Bar(
+            x=message_counts['Messages'],
+            y=message_counts['Participant'],
+            orientation='h',
+            marker=dict(
+                color=message_counts['Messages'],
+                colorscale='Purples',
+                line=dict(color='rgba(102, 126, 234, 0.3)', width=1)
+            ),
+            text=message_counts['Messages'],
+            textposition='outside',
+            textfont=dict(family='Inter', size=12, color='#4a5568'),
+            hovertemplate='<b>%{y}</b><br>Messages: %{x}<extra></extra>'
+        ))
+
+        fig.update_layout(
+            title=dict(text=f'Top {len(message_counts)} Participants', font=dict(family='Poppins', size=20, color='#2d3748'), x=0.5),
+            xaxis=dict(title=dict(text='Nombre de messages', font=dict(family='Inter', size=14, color='#718096'))),
+            yaxis=dict(title='', tickfont=dict(family='Inter', size=12, color='#4a5568')),
+            plot_bgcolor='white',
+            paper_bgcolor='rgba(0,0,0,0)',
+            height=max(450, len(message_counts) * 35),
+            margin=dict(l=20, r=80, t=60, b=50),
+            bargap=0.3
+        )
+
+    st.plotly_chart(fig, use_container_width=True, key="main_chart")
+
+def render_details(stats_df, selected_groups, multiple_groups):
+    """Section : détails par participant"""
+    st.markdown("### 📋 Détails par participant")
+
+    if multiple_groups:
+        # Configuration des colonnes
+        col_config = {
+            "Rang": st.column_config.NumberColumn("🏅", width="small"),
+            "Participant": st.column_config.TextColumn("👤 Participant"),
+            "Total": st.column_config.NumberColumn("💬 Total", format="%d"),
+            "Caractères": st.column_config.NumberColumn("📝 Car.", format="%d"),
+            "Moy. car.": st.column_config.NumberColumn("📏 Moy.", format="%.1f"),
+            "%": st.column_config.NumberColumn("📊 %", format="%.1f%%")
+        }
+
+        for grp in sorted(selected_groups):
+            col_config[grp] = st.column_config.NumberColumn(f"📁 {grp[:15]}...", format="%d") if len(grp) > 15 else st.column_config.NumberColumn(f"📁 {grp}", format="%d")
+
+        st.dataframe(stats_df, use_container_width=True, hide_index=True, column_config=col_config)
+    else:
+        st.dataframe(
+            stats_df,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Rang": st.column_config.NumberColumn("🏅 Rang", width="small"),
+                "Participant": st.column_config.TextColumn("👤 Participant"),
+                "Messages": st.column_config.NumberColumn("💬 Messages", format="%d"),
+                "Caractères totaux": st.column_config.NumberColumn("📝 Caractères", format="%d"),
+                "Longueur moyenne": st.column_config.NumberColumn("📏 Moy. caractères", format="%.1f"),
+                "Pourcentage": st.column_config.NumberColumn("📊 Part (%)", format="%.1f%%")
+            }
+        )
+
+def render_timeline(by_date_group, multiple_groups):
+    """Section : activité dans le temps"""
+    st.markdown("### 📅 Activité dans le temps")
+
+    if multiple_groups:
+        # Graphique temporel par groupe
+        fig_timeline = px.line(
+            by_date_group,
+            x='date',
+            y='Messages',
+            color='groupe',
+            title='Évolution quotidienne par groupe',
+            markers=True,
+            color_discrete_sequence=px.colors.qualitative.Set2
+        )
+
+        fig_timeline.update_layout(
+            title=dict(font=dict(family='Poppins', size=18, color='#2d3748'), x=0.5),
+            xaxis=dict(title=dict(text='Date', font=dict(family='Inter', size=14, color='#718096'))),
+            yaxis=dict(title=dict(text='Messages', font=dict(family='Inter', size=14, color='#718096'))),
+            legend=dict(title='Groupe', font=dict(family='Inter')),
+            plot_bgcolor='white',
+            paper_bgcolor='rgba(0,0,0,0)',
+            height=400
+        )
+    else:
+        daily_counts = by_date_group.groupby('date')['Messages'].sum().reset_index()
+
+        fig_timeline = go.Figure()
+
+        fig_timeline.add_trace(go.Scatter(
+            x=daily_counts['date'],
+            y=daily_counts['Messages'],
+            mode='lines+markers',
+            line=dict(color='#667eea', width=3, shape='spline'),
+            marker=dict(size=8, color='#764ba2', line=dict(color='white', width=2)),
+            fill='tozeroy',
+            fillcolor='rgba(102, 126, 234, 0.1)',
+            hovertemplate='<b>%{x}</b><br>Messages: %{y}<extra></extra>'
+        ))
+
+        fig_timeline.update_layout(
+            title=dict(text='Évolution quotidienne de l\'activité', font=dict(family='Poppins', size=18, color='#2d3748'), x=0.5),
+            xaxis=dict(title=dict(text='Date', font=dict(family='Inter', size=14, color='#718096'))),
+            yaxis=dict(title=dict(text='Messages', font=dict(family='Inter', size=14, color='#718096'))),
+            plot_bgcolor='white',
+            paper_bgcolor='rgba(0,0,0,0)',
+            height=400
+        )
+
+    st.plotly_chart(fig_timeline, use_container_width=True, key="timeline_chart")
+
+def render_groups(by_sender_group, multiple_groups):
+    """Section : répartition par groupe"""
+    st.markdown("### 📊 Répartition par groupe")
+
+    if not multiple_groups:
+        st.info("ℹ️ Sélectionnez plusieurs groupes pour comparer leur activité.")
+        return
+
+    group_totals = by_sender_group.groupby('groupe')['Messages'].sum().reset_index()
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        fig_pie = px.pie(
+            group_totals,
+            values='Messages',
+            names='groupe',
+            title='Distribution des messages par groupe',
+            color_discrete_sequence=px.colors.qualitative.Set2
+        )
+        fig_pie.update_layout(
+            title=dict(font=dict(family='Poppins', size=16, color='#2d3748'), x=0.5),
+            legend=dict(font=dict(family='Inter'))
+        )
+        st.plotly_chart(fig_pie, use_container_width=True, key="pie_chart")
+
+    with col2:
+        fig_bar_groups = px.bar(
+            group_totals.sort_values('Messages', ascending=True),
+            x='Messages',
+            y='groupe',
+            orientation='h',
+            title='Messages par groupe',
+            color='Messages',
+            color_continuous_scale='Purples'
+        )
+        fig_bar_groups.update_layout(
+            title=dict(font=dict(family='Poppins', size=16, color='#2d3748'), x=0.5),
+            showlegend=False,
+            plot_bgcolor='white',
+            paper_bgcolor='rgba(0,0,0,0)'
+        )
+        st.plotly_chart(fig_bar_groups, use_container_width=True, key="bar_groups")
+
+@st.fragment
+def render_vocabulary(con, df, file_keys, filters, by_sender_group, multiple_groups):
+    """Section : vocabulaire (fragment, relancé seul lorsque ses options changent)"""
+    st.markdown("### 🔤 Vocabulaire")
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        token_type = st.selectbox(
+            "Type",
+            options=list(TOKEN_TYPES),
+            index=saved_index("vocab_type", list(TOKEN_TYPES)),
+            format_func=TOKEN_TYPES.get,
+            key="vocab_type",
+            on_change=save_value,
+            args=("vocab_type",)
+        )
+
+    with col2:
+        scopes = {'all': 'Sélection entière', 'sender': 'Par participant'}
+        if multiple_groups:
+            scopes['groupe'] = 'Par groupe'
+        scope = st.selectbox(
+            "Périmètre",
+            options=list(scopes),
+            index=saved_index("vocab_scope", list(scopes)),
+            format_func=scopes.get,
+            key="vocab_scope",
+            on_change=save_value,
+            args=("vocab_scope",)
+        )
+
+    with col3:
+        if scope == 'sender':
+            participants = by_sender_group.groupby('sender')['Messages'].sum().sort_values(ascending=False).index.tolist()
+            scope_value = st.selectbox(
+                "Participant",
+                options=participants,
+                index=saved_index("vocab_sender", participants),
+                key="vocab_sender",
+                on_change=save_value,
+                args=("vocab_sender",)
+            )
+        elif scope == 'groupe':
+            scope_value = st.selectbox(
+                "Groupe",
+                options=sorted(filters[0]),
+                index=saved_index("vocab_group", sorted(filters[0])),
+                key="vocab_group",
+                on_change=save_value,
+                args=("vocab_group",)
+            )
+        else:
+            scope_value = None
+
+    if con is not None:
+        top_df = sql_top_tokens(
+            con, file_keys, *filters,
+            token_type,
+            by=None if scope == 'all' else scope,
+            value=scope_value
+        )
+    else:
+        token_index = build_token_index(file_keys, df)
+        top_df = top_tokens(
+            token_index,
+            build_filter_mask(token_index[0], *filters),
+            token_type,
+            by=None if scope == 'all' else scope,
+            value=scope_value
+        )
+
+    if not top_df.empty:
+        fig_vocab = px.bar(
+            top_df.sort_values('Occurrences', ascending=True),
+            x='Occurrences',
+            y='Token',
+            orientation='h',
+            title=f'Top {len(top_df)} {TOKEN_TYPES[token_type].lower()}',
+            color='Occurrences',
+            color_continuous_scale='Purples'
+        )
+        fig_vocab.update_layout(
+            title=dict(font=dict(family='Poppins', size=16, color='#2d3748'), x=0.5),
+            xaxis=dict(title=dict(text='Occurrences', font=dict(family='Inter', size=14, color='#718096'))),
+            yaxis=dict(title=dict(text=''), tickfont=dict(family='Inter', size=12, color='#4a5568')),
+            showlegend=False,
+            plot_bgcolor='white',
+            paper_bgcolor='rgba(0,0,0,0)',
+            height=max(400, len(top_df) * 25)
+        )
+        st.plotly_chart(fig_vocab, use_container_width=True, key="vocab_chart")
+    else:
+        st.info(f"ℹ️ Aucun élément de type « {TOKEN_TYPES[token_type].lower()} » pour cette sélection.")
+
+@st.fragment
+def render_interactions(con, df, file_keys, filters):
+    """Section : interactions entre participants (fragment)"""
+    st.markdown("### 🔗 Interactions entre participants")
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        reply_window = st.slider(
+            "⏱️ Fenêtre de réponse (minutes)",
+            min_value=1,
+            max_value=60,
+            value=saved_value("reply_window", 5),
+            key="reply_window",
+            on_change=save_value,
+            args=("reply_window",),
+            help="Délai maximal pour considérer un message comme une réponse au précédent"
+        )
+
+    with col2:
+        interaction_kinds = st.multiselect(
+            "Interactions",
+            options=list(INTERACTION_KINDS),
+            default=saved_value("interaction_kinds", list(INTERACTION_KINDS)),
+            format_func=INTERACTION_KINDS.get,
+            key="interaction_kinds",
+            on_change=save_value,
+            args=("interaction_kinds",)
+        )
+
+    with col3:
+        top_n = st.slider(
+            "👥 Participants affichés",
+            min_value=5,
+            max_value=50,
+            value=saved_value("interaction_top_n", 20),
+            key="interaction_top_n",
+            on_change=save_value,
+            args=("interaction_top_n",)
+        )
+
+    if con is not None:
+        senders_index, adjacency = sql_interaction_matrix(con, file_keys, *filters, interaction_kinds, reply_window)
+    else:
+        interactions = get_interaction_edges(file_keys, df, reply_window)
+        senders_index = interactions[0]
+        adjacency = interaction_matrix(interactions, *filters, interaction_kinds)
+
+    if adjacency.nnz:
+        # Participants les plus connectés (messages envoyés + reçus)
+        degree = np.asarray(adjacency.sum(axis=0)).ravel() + np.asarray(adjacency.sum(axis=1)).ravel()
+        top = np.argsort(-degree, kind='stable')[:top_n]
+        top = top[degree[top] > 0]
+        labels = senders_index[top].tolist()
+
+        fig_heatmap = px.imshow(
+            adjacency[top][:, top].toarray(),
+            x=labels,
+            y=labels,
+            labels=dict(x='Destinataire', y='Auteur', color='Interactions'),
+            title='Qui interagit avec qui',
+            color_continuous_scale='Purples',
+            aspect='auto'
+        )
+        fig_heatmap.update_layout(
+            title=dict(font=dict(family='Poppins', size=18, color='#2d3748'), x=0.5),
+            xaxis=dict(tickfont=dict(family='Inter', size=11, color='#4a5568')),
+            yaxis=dict(tickfont=dict(family='Inter', size=11, color='#4a5568')),
+            paper_bgcolor='rgba(0,0,0,0)',
+            height=max(450, len(labels) * 28)
+        )
+        st.plotly_chart(fig_heatmap, use_container_width=True, key="interaction_heatmap")
+
+        pairs = adjacency.tocoo()
+        pairs_df = pd.DataFrame({
+            'Auteur': senders_index[pairs.row],
+            'Destinataire': senders_index[pairs.col],
+            'Interactions': pairs.data
+        }).sort_values('Interactions', ascending=False).head(20)
+
+        st.dataframe(
+            pairs_df,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Auteur": st.column_config.TextColumn("👤 Auteur"),
+                "Destinataire": st.column_config.TextColumn("🎯 Destinataire"),
+                "Interactions": st.column_config.NumberColumn("🔗 Interactions", format="%d")
+            }
+        )
+    else:
+        st.info("ℹ️ Aucune interaction détectée pour cette sélection.")
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_excel_export(stats_df, by_sender_group, by_date_group, multiple_groups):
+    """Génère le classeur Excel exporté (mis en cache pour les derniers états des filtres)"""
+    excel_buffer = io.BytesIO()
+    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
+        stats_df.to_excel(writer, sheet_name='Classement', index=False)
+
+        daily_counts_export = by_date_group.groupby('date')['Messages'].sum().reset_index()
+        daily_counts_export.to_excel(writer, sheet_name='Activité journalière', index=False)
+
+        if multiple_groups:
+            # Ventilation par groupe
+            group_summary = by_sender_group.groupby('groupe').agg({
+                'sender': 'nunique',
+                'Messages': 'sum'
+            }).reset_index()
+            group_summary.columns = ['Groupe', 'Participants', 'Messages']
+            group_summary.to_excel(writer, sheet_name='Par groupe', index=False)
+
+            # Détail par groupe et participant
+            detail_by_group = by_sender_group[['groupe', 'sender', 'Messages']]
+            detail_by_group = detail_by_group.sort_values(['groupe', 'Messages'], ascending=[True, False])
+            detail_by_group.to_excel(writer, sheet_name='Détail par groupe', index=False)
+
+    return excel_buffer.getvalue()
+
+@st.fragment
+def render_export(stats_df, by_sender_group, by_date_group, start_date, end_date, multiple_groups):
+    """Section : export des résultats (fragment)"""
+    st.markdown("### 💾 Exporter les résultats")
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        excel_data = build_excel_export(stats_df, by_sender_group, by_date_group, multiple_groups)
+
+        st.download_button(
+            label="📥 Excel (.xlsx)",
+            data=excel_data,
+            file_name=f"whatsapp_analytics_{start_date}_{end_date}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
+    with col2:
+        csv = stats_df.to_csv(index=False).encode('utf-8')
+        st.download_button(
+            label="📥 CSV",
+            data=csv,
+            file_name=f"whatsapp_analytics_{start_date}_{end_date}.csv",
+            mime="text/csv"
+        )
+
+    with col3:
+        json_data = stats_df.to_json(orient='records', indent=2)
+        st.download_button(
+            label="📥 JSON",
+            data=json_data,
+            file_name=f"whatsapp_analytics_{start_date}_{end_date}.json",
+            mime="application/json"
+        )
+
 # Configuration de la page
 st.set_page_config(
     page_title="WhatsApp Analytics",
@@ -225,28 +1246,38 @@ with st.sidebar:
         st.success(f"✅ {len(uploaded_files)} fichier(s) chargé(s)")
         for f in uploaded_files:
             st.info(f"📄 {f.name}")
+    
+    # Backend optionnel pour les archives qui ne tiennent pas en mémoire
+    use_duckdb = duckdb is not None and st.checkbox(
+        "🗄️ Mode grandes archives",
+        value=False,
+        help="Stocke les messages dans une base DuckDB sur disque au lieu de la mémoire"
+    )
 
 # Corps principal
 if uploaded_files:
     with st.spinner('🔄 Analyse en cours...'):
-        # Charger et combiner tous les fichiers
-        all_dfs = []
-        group_names = []
+        # Les fichiers ne sont parsés qu'une fois par jeu de fichiers chargés
+        file_keys = tuple((f.file_id, f.name, f.size) for f in uploaded_files)
         
-        for uploaded_file in uploaded_files:
-            file_content, group_name = load_file(uploaded_file)
-            if file_content:
-                df_single = parse_whatsapp_file(file_content, group_name)
-                if not df_single.empty:
-                    all_dfs.append(df_single)
-                    if group_name not in group_names:
-                        group_names.append(group_name)
+        if use_duckdb:
+            df = None
+            forget_messages()
+            con, group_names = load_into_duckdb(file_keys, uploaded_files)
+            if group_names:
+                total_messages, total_senders, min_date, max_date = sql_overview(con, file_keys)
+        else:
+            con = None
+            close_duckdb()
+            df, group_names = load_messages(file_keys, uploaded_files)
+            if group_names:
+                total_messages = len(df)
+                total_senders = df['sender'].nunique()
+                min_date = df['date'].min()
+                max_date = df['date'].max()
         
-        if all_dfs:
-            # Combiner tous les DataFrames
-            df = pd.concat(all_dfs, ignore_index=True)
-            
-            st.success(f"✅ {len(df)} messages analysés depuis {len(group_names)} groupe(s)!")
+        if group_names:
+            st.success(f"✅ {total_messages} messages analysés depuis {len(group_names)} groupe(s)!")
             
             # Statistiques globales
             st.markdown("### 📈 Vue d'ensemble")
@@ -256,7 +1287,7 @@ if uploaded_files:
             with col1:
                 st.markdown(f"""
                 <div class="stat-card">
-                    <div class="stat-value">{len(df)}</div>
+                    <div class="stat-value">{total_messages}</div>
                     <div class="stat-label">Messages</div>
                 </div>
                 """, unsafe_allow_html=True)
@@ -264,7 +1295,7 @@ if uploaded_files:
             with col2:
                 st.markdown(f"""
                 <div class="stat-card">
-                    <div class="stat-value">{df['sender'].nunique()}</div>
+                    <div class="stat-value">{total_senders}</div>
                     <div class="stat-label">Participants</div>
                 </div>
                 """, unsafe_allow_html=True)
@@ -278,7 +1309,7 @@ if uploaded_files:
                 """, unsafe_allow_html=True)
             
             with col4:
-                date_range = (df['date'].max() - df['date'].min()).days
+                date_range = (max_date - min_date).days
                 st.markdown(f"""
                 <div class="stat-card">
                     <div class="stat-value">{date_range}</div>
@@ -287,7 +1318,7 @@ if uploaded_files:
                 """, unsafe_allow_html=True)
             
             with col5:
-                avg_per_day = len(df) / max(date_range, 1)
+                avg_per_day = total_messages / max(date_range, 1)
                 st.markdown(f"""
                 <div class="stat-card">
                     <div class="stat-value">{avg_per_day:.1f}</div>
@@ -321,8 +1352,11 @@ if uploaded_files:
                 )
                 
                 # Filtrer d'abord par groupe pour obtenir la liste des participants
-                df_by_group = df[df['groupe'].isin(selected_groups)]
-                all_senders = sorted(df_by_group['sender'].unique())
+                if use_duckdb:
+                    all_senders = sql_senders(con, file_keys, selected_groups)
+                else:
+                    df_by_group = df[df['groupe'].isin(selected_groups)]
+                    all_senders = sorted(df_by_group['sender'].unique())
                 
                 if exclude_unknown:
                     all_senders = [s for s in all_senders if not is_phone_number(s)]
@@ -335,8 +1369,6 @@ if uploaded_files:
                 )
                 
                 st.markdown("#### 📅 Période")
-                min_date = df['date'].min()
-                max_date = df['date'].max()
                 
                 col_date1, col_date2 = st.columns(2)
                 with col_date1:
@@ -354,316 +1386,61 @@ if uploaded_files:
                         max_value=max_date
                     )
             
-            # Filtrer les données
-            mask = (
-                (df['groupe'].isin(selected_groups)) &
-                (df['sender'].isin(selected_senders)) &
-                (df['date'] >= start_date) &
-                (df['date'] <= end_date)
-            )
-            filtered_df = df[mask]
+            # Filtrer et agréger les données
+            if use_duckdb:
+                by_sender_group, by_date_group = sql_aggregate_messages(con, file_keys, selected_groups, selected_senders, start_date, end_date)
+            else:
+                by_sender_group, by_date_group = aggregate_messages(df, selected_groups, selected_senders, start_date, end_date)
             
-            if not filtered_df.empty:
+            if not by_sender_group.empty:
                 multiple_groups = len(selected_groups) > 1
+                filters = (selected_groups, selected_senders, start_date, end_date)
                 
-                # Compter les messages par participant (total)
-                message_counts = filtered_df['sender'].value_counts().reset_index()
-                message_counts.columns = ['Participant', 'Messages']
-                message_counts = message_counts.sort_values('Messages', ascending=True)
-                
-                # === GRAPHIQUE PRINCIPAL ===
-                st.markdown("### 🏆 Classement des interventions")
-                
-                if multiple_groups:
-                    # Graphique empilé par groupe
-                    group_participant_counts = filtered_df.groupby(['sender', 'groupe']).size().reset_index(name='Messages')
-                    
-                    fig = px.bar(
-                        group_participant_counts,
-                        x='Messages',
-                        y='sender',
-                        color='groupe',
-                        orientation='h',
-                        title=f'Top {len(message_counts)} Participants (ventilé par groupe)',
-                        color_discrete_sequence=px.colors.qualitative.Set2
-                    )
-                    
-                    # Trier par total de messages
-                    order = message_counts['Participant'].tolist()
-                    fig.update_yaxes(categoryorder='array', categoryarray=order)
-                    
-                    fig.update_layout(
-                        title=dict(font=dict(family='Poppins', size=20, color='#2d3748'), x=0.5),
-                        xaxis=dict(title=dict(text='Nombre de messages', font=dict(family='Inter', size=14, color='#718096'))),
-                        yaxis=dict(title=dict(text=''), tickfont=dict(family='Inter', size=11, color='#4a5568')),
-                        legend=dict(title='Groupe', font=dict(family='Inter')),
-                        plot_bgcolor='white',
-                        paper_bgcolor='rgba(0,0,0,0)',
-                        height=max(500, len(message_counts) * 35),
-                        bargap=0.3
-                    )
-                else:
-                    # Graphique simple
-                    fig = go.Figure()
-                    
-                    fig.add_trace(go.Bar(
-                        x=message_counts['Messages'],
-                        y=message_counts['Participant'],
-                        orientation='h',
-                        marker=dict(
-                            color=message_counts['Messages'],
-                            colorscale='Purples',
-                            line=dict(color='rgba(102, 126, 234, 0.3)', width=1)
-                        ),
-                        text=message_counts['Messages'],
-                        textposition='outside',
-                        textfont=dict(family='Inter', size=12, color='#4a5568'),
-                        hovertemplate='<b>%{y}</b><br>Messages: %{x}<extra></extra>'
-                    ))
-                    
-                    fig.update_layout(
-                        title=dict(text=f'Top {len(message_counts)} Participants', font=dict(family='Poppins', size=20, color='#2d3748'), x=0.5),
-                        xaxis=dict(title=dict(text='Nombre de messages', font=dict(family='Inter', size=14, color='#718096'))),
-                        yaxis=dict(title='', tickfont=dict(family='Inter', size=12, color='#4a5568')),
-                        plot_bgcolor='white',
-                        paper_bgcolor='rgba(0,0,0,0)',
-                        height=max(450, len(message_counts) * 35),
-                        margin=dict(l=20, r=80, t=60, b=50),
-                        bargap=0.3
-                    )
-                
-                st.plotly_chart(fig, use_container_width=True, key="main_chart")
-                
-                # === TABLEAU DÉTAILLÉ ===
-                st.markdown("### 📋 Détails par participant")
-                
-                if multiple_groups:
-                    # Tableau avec ventilation par groupe
-                    detailed_stats = []
-                    for sender in message_counts.sort_values('Messages', ascending=False)['Participant']:
-                        sender_df = filtered_df[filtered_df['sender'] == sender]
-                        total_chars = sender_df['message'].str.len().sum()
-                        avg_length = sender_df['message'].str.len().mean()
-                        
-                        # Ventilation par groupe
-                        group_breakdown = sender_df.groupby('groupe').size().to_dict()
-                        
-                        row = {
-                            'Participant': sender,
-                            'Total': len(sender_df),
-                            'Caractères': int(total_chars),
-                            'Moy. car.': round(avg_length, 1),
-                            '%': round(len(sender_df)/len(filtered_df)*100, 1)
-                        }
-                        
-                        # Ajouter une colonne par groupe
-                        for grp in sorted(selected_groups):
-                            row[grp] = group_breakdown.get(grp, 0)
-                        
-                        detailed_stats.append(row)
-                    
-                    stats_df = pd.DataFrame(detailed_stats)
-                    stats_df.insert(0, 'Rang', range(1, len(stats_df) + 1))
-                    
-                    # Configuration des colonnes
-                    col_config = {
-                        "Rang": st.column_config.NumberColumn("🏅", width="small"),
-                        "Participant": st.column_config.TextColumn("👤 Participant"),
-                        "Total": st.column_config.NumberColumn("💬 Total", format="%d"),
-                        "Caractères": st.column_config.NumberColumn("📝 Car.", format="%d"),
-                        "Moy. car.": st.column_config.NumberColumn("📏 Moy.", format="%.1f"),
-                        "%": st.column_config.NumberColumn("📊 %", format="%.1f%%")
-                    }
-                    
-                    for grp in sorted(selected_groups):
-                        col_config[grp] = st.column_config.NumberColumn(f"📁 {grp[:15]}...", format="%d") if len(grp) > 15 else st.column_config.NumberColumn(f"📁 {grp}", format="%d")
-                    
-                    st.dataframe(stats_df, use_container_width=True, hide_index=True, column_config=col_config)
-                else:
-                    # Tableau simple
-                    detailed_stats = []
-                    for sender in message_counts.sort_values('Messages', ascending=False)['Participant']:
-                        sender_df = filtered_df[filtered_df['sender'] == sender]
-                        total_chars = sender_df['message'].str.len().sum()
-                        avg_length = sender_df['message'].str.len().mean()
-                        
-                        detailed_stats.append({
-                            'Participant': sender,
-                            'Messages': len(sender_df),
-                            'Caractères totaux': int(total_chars),
-                            'Longueur moyenne': round(avg_length, 1),
-                            'Pourcentage': round(len(sender_df)/len(filtered_df)*100, 1)
-                        })
-                    
-                    stats_df = pd.DataFrame(detailed_stats)
-                    stats_df.insert(0, 'Rang', range(1, len(stats_df) + 1))
-                    
-                    st.dataframe(
-                        stats_df,
-                        use_container_width=True,
-                        hide_index=True,
-                        column_config={
-                            "Rang": st.column_config.NumberColumn("🏅 Rang", width="small"),
-                            "Participant": st.column_config.TextColumn("👤 Participant"),
-                            "Messages": st.column_config.NumberColumn("💬 Messages", format="%d"),
-                            "Caractères totaux": st.column_config.NumberColumn("📝 Caractères", format="%d"),
-                            "Longueur moyenne": st.column_config.NumberColumn("📏 Moy. caractères", format="%.1f"),
-                            "Pourcentage": st.column_config.NumberColumn("📊 Part (%)", format="%.1f%%")
-                        }
-                    )
-                
-                # === GRAPHIQUE TEMPOREL ===
-                st.markdown("### 📅 Activité dans le temps")
+                # Navigation : seule la section affichée est calculée
+                sections = {
+                    'ranking': '🏆 Classement',
+                    'details': '📋 Détails',
+                    'timeline': '📅 Chronologie',
+                    'groups': '📊 Groupes',
+                    'vocabulary': '🔤 Vocabulaire',
+                    'interactions': '🔗 Interactions',
+                    'export': '💾 Export',
+                }
+                section = st.radio(
+                    "Section",
+                    options=list(sections),
+                    format_func=sections.get,
+                    horizontal=True,
+                    label_visibility="collapsed",
+                    key="section"
+                )
                 
-                if multiple_groups:
-                    # Graphique temporel par groupe
-                    daily_by_group = filtered_df.groupby(['date', 'groupe']).size().reset_index(name='Messages')
-                    
-                    fig_timeline = px.line(
-                        daily_by_group,
-                        x='date',
-                        y='Messages',
-                        color='groupe',
-                        title='Évolution quotidienne par groupe',
-                        markers=True,
-                        color_discrete_sequence=px.colors.qualitative.Set2
-                    )
-                    
-                    fig_timeline.update_layout(
-                        title=dict(font=dict(family='Poppins', size=18, color='#2d3748'), x=0.5),
-                        xaxis=dict(title=dict(text='Date', font=dict(family='Inter', size=14, color='#718096'))),
-                        yaxis=dict(title=dict(text='Messages', font=dict(family='Inter', size=14, color='#718096'))),
-                        legend=dict(title='Groupe', font=dict(family='Inter')),
-                        plot_bgcolor='white',
-                        paper_bgcolor='rgba(0,0,0,0)',
-                        height=400
-                    )
+                if section == 'ranking':
+                    render_ranking(by_sender_group, multiple_groups)
+                elif section == 'details':
+                    stats_df = build_stats_table(by_sender_group, selected_groups, multiple_groups)
+                    render_details(stats_df, selected_groups, multiple_groups)
+                elif section == 'timeline':
+                    render_timeline(by_date_group, multiple_groups)
+                elif section == 'groups':
+                    render_groups(by_sender_group, multiple_groups)
+                elif section == 'vocabulary':
+                    render_vocabulary(con, df, file_keys, filters, by_sender_group, multiple_groups)
+                elif section == 'interactions':
+                    render_interactions(con, df, file_keys, filters)
                 else:
-                    daily_counts = filtered_df.groupby('date').size().reset_index(name='Messages')
-                    
-                    fig_timeline = go.Figure()
-                    
-                    fig_timeline.add_trace(go.Scatter(
-                        x=daily_counts['date'],
-                        y=daily_counts['Messages'],
-                        mode='lines+markers',
-                        line=dict(color='#667eea', width=3, shape='spline'),
-                        marker=dict(size=8, color='#764ba2', line=dict(color='white', width=2)),
-                        fill='tozeroy',
-                        fillcolor='rgba(102, 126, 234, 0.1)',
-                        hovertemplate='<b>%{x}</b><br>Messages: %{y}<extra></extra>'
-                    ))
-                    
-                    fig_timeline.update_layout(
-                        title=dict(text='Évolution quotidienne de l\'activité', font=dict(family='Poppins', size=18, color='#2d3748'), x=0.5),
-                        xaxis=dict(title=dict(text='Date', font=dict(family='Inter', size=14, color='#718096'))),
-                        yaxis=dict(title=dict(text='Messages', font=dict(family='Inter', size=14, color='#718096'))),
-                        plot_bgcolor='white',
-                        paper_bgcolor='rgba(0,0,0,0)',
-                        height=400
-                    )
-                
-                st.plotly_chart(fig_timeline, use_container_width=True, key="timeline_chart")
-                
-                # === GRAPHIQUE PAR GROUPE (si plusieurs groupes) ===
-                if multiple_groups:
-                    st.markdown("### 📊 Répartition par groupe")
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        group_totals = filtered_df.groupby('groupe').size().reset_index(name='Messages')
-                        
-                        fig_pie = px.pie(
-                            group_totals,
-                            values='Messages',
-                            names='groupe',
-                            title='Distribution des messages par groupe',
-                            color_discrete_sequence=px.colors.qualitative.Set2
-                        )
-                        fig_pie.update_layout(
-                            title=dict(font=dict(family='Poppins', size=16, color='#2d3748'), x=0.5),
-                            legend=dict(font=dict(family='Inter'))
-                        )
-                        st.plotly_chart(fig_pie, use_container_width=True, key="pie_chart")
-                    
-                    with col2:
-                        fig_bar_groups = px.bar(
-                            group_totals.sort_values('Messages', ascending=True),
-                            x='Messages',
-                            y='groupe',
-                            orientation='h',
-                            title='Messages par groupe',
-                            color='Messages',
-                            color_continuous_scale='Purples'
-                        )
-                        fig_bar_groups.update_layout(
-                            title=dict(font=dict(family='Poppins', size=16, color='#2d3748'), x=0.5),
-                            showlegend=False,
-                            plot_bgcolor='white',
-                            paper_bgcolor='rgba(0,0,0,0)'
-                        )
-                        st.plotly_chart(fig_bar_groups, use_container_width=True, key="bar_groups")
-                
-                # === EXPORT ===
-                st.markdown("### 💾 Exporter les résultats")
-                
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    excel_buffer = io.BytesIO()
-                    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                        stats_df.to_excel(writer, sheet_name='Classement', index=False)
-                        
-                        daily_counts_export = filtered_df.groupby('date').size().reset_index(name='Messages')
-                        daily_counts_export.to_excel(writer, sheet_name='Activité journalière', index=False)
-                        
-                        if multiple_groups:
-                            # Ventilation par groupe
-                            group_summary = filtered_df.groupby('groupe').agg({
-                                'sender': 'nunique',
-                                'message': 'count'
-                            }).reset_index()
-                            group_summary.columns = ['Groupe', 'Participants', 'Messages']
-                            group_summary.to_excel(writer, sheet_name='Par groupe', index=False)
-                            
-                            # Détail par groupe et participant
-                            detail_by_group = filtered_df.groupby(['groupe', 'sender']).size().reset_index(name='Messages')
-                            detail_by_group = detail_by_group.sort_values(['groupe', 'Messages'], ascending=[True, False])
-                            detail_by_group.to_excel(writer, sheet_name='Détail par groupe', index=False)
-                    
-                    excel_data = excel_buffer.getvalue()
-                    
-                    st.download_button(
-                        label="📥 Excel (.xlsx)",
-                        data=excel_data,
-                        file_name=f"whatsapp_analytics_{start_date}_{end_date}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-                
-                with col2:
-                    csv = stats_df.to_csv(index=False).encode('utf-8')
-                    st.download_button(
-                        label="📥 CSV",
-                        data=csv,
-                        file_name=f"whatsapp_analytics_{start_date}_{end_date}.csv",
-                        mime="text/csv"
-                    )
-                
-                with col3:
-                    json_data = stats_df.to_json(orient='records', indent=2)
-                    st.download_button(
-                        label="📥 JSON",
-                        data=json_data,
-                        file_name=f"whatsapp_analytics_{start_date}_{end_date}.json",
-                        mime="application/json"
-                    )
+                    stats_df = build_stats_table(by_sender_group, selected_groups, multiple_groups)
+                    render_export(stats_df, by_sender_group, by_date_group, start_date, end_date, multiple_groups)
                 
             else:
                 st.warning("⚠️ Aucun message ne correspond aux filtres sélectionnés.")
         else:
             st.error("❌ Impossible de parser les fichiers. Vérifiez le format.")
 else:
+    # Aucun fichier : libérer les données de la session
+    forget_messages()
+    close_duckdb()
+
     # Page d'accueil
     st.markdown("""
     <div style='text-align: center; padding: 2rem;'>